@@ -3,9 +3,14 @@ from datetime import datetime, timezone, timedelta
 import json
 import logging
 from os import getenv
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Optional
 
+from google.api_core import exceptions
 from google.cloud import bigquery
+from google.cloud import pubsub_v1
+from toki_tracing.tracing import span, traced
+
 
 logger = logging.getLogger("billing_aggregator.main")
 logger.addHandler(logging.StreamHandler())
@@ -20,10 +25,17 @@ START_DATE_PARAM = "start_date"
 END_DATE_PARAM = "end_date"
 POINT_ID_PARAM = "point_ids"
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+BILLING_SUBSCRIPTION = getenv("BILLING_SUBSCRIPTION", f"billing-batch-{PROJECT_ID}")
+BATCH_WINDOW_SECONDS = float(getenv("BATCH_WINDOW_SECONDS", "30"))
+BATCH_MAX_MESSAGES = int(getenv("BATCH_MAX_MESSAGES", "1000"))
+PULL_MAX_MESSAGES = 100
+PULL_TIMEOUT_SECONDS = 10
 
 BIG_QUERY_CLIENT = None
+SUBSCRIBER_CLIENT = None
 
 
+@traced(logger)
 def billing_aggregator(event: Dict[str, Any], context) -> None:
     """
     Entry point that extracts metering point ids, start and end time from an event and moves billing data for those
@@ -48,24 +60,175 @@ def billing_aggregator(event: Dict[str, Any], context) -> None:
 
     start_date, end_date = extract_date_range(data)
 
+    bill_points(points_to_bill, start_date, end_date)
+
+
+@traced(logger)
+def billing_batch_aggregator(request) -> str:
+    """
+    Entry point that pulls billing events from a subscription for up to BATCH_WINDOW_SECONDS or BATCH_MAX_MESSAGES
+    messages, coalesces them by billing period and runs a single billing job per period. Messages are acknowledged
+    only after the job for their period has finished. A failed job is logged and the other periods are still billed,
+    events of the failed job are redelivered until they are moved to the dead letter topic of the subscription.
+    :param request:
+        Contains the HTTP request of the scheduled invocation.
+    :return: str
+        Returns a summary of the processed batch.
+    """
+
+    subscriber = get_subscriber_client()
+    subscription_path = subscriber.subscription_path(PROJECT_ID, BILLING_SUBSCRIPTION)
+    with span("pull_billing_events") as record:
+        received_messages = pull_billing_events(subscriber, subscription_path)
+        record["messages"] = len(received_messages)
+    logger.info(f"Pulled {len(received_messages)} billing events")
+
+    periods, invalid_ack_ids = group_events_by_period(received_messages)
+    if len(invalid_ack_ids) > 0:
+        subscriber.acknowledge(request={"subscription": subscription_path, "ack_ids": invalid_ack_ids})
+    billed_count = 0
+    failed_periods = []
+    for (start_date, end_date), (points_to_bill, ack_ids) in periods.items():
+        if len(points_to_bill) > 0:
+            try:
+                bill_points(points_to_bill, start_date, end_date)
+            except Exception:
+                logger.exception(f"Billing job from {start_date} to {end_date} failed, {len(ack_ids)} events are "
+                                 f"left unacknowledged")
+                failed_periods.append((start_date, end_date))
+                continue
+        with span("acknowledge") as record:
+            record["messages"] = len(ack_ids)
+            subscriber.acknowledge(request={"subscription": subscription_path, "ack_ids": ack_ids})
+        billed_count += len(ack_ids)
+
+    billed_jobs = len(periods) - len(failed_periods)
+    return (f"Billed {billed_count} events in {billed_jobs} jobs, failed {len(failed_periods)} jobs, "
+            f"dropped {len(invalid_ack_ids)} invalid events")
+
+
+def bill_points(points_to_bill: List[str], start_date: str, end_date: str) -> None:
+    """
+    Runs the billing job for the given points and period.
+    :param points_to_bill: List[str]
+        List of metering point ids that should be billed.
+    :param start_date: str
+        The start date for the billing period.
+    :param end_date: str
+        The end date for the billing period.
+    :return: None
+    """
+
     job_config = get_job_config(points_to_bill, start_date, end_date)
     query = get_billing_query()
     query_client = get_big_query_client()
 
-    _ = execute_billing_job(query_client, query, job_config)
+    with span("execute_billing_job") as record:
+        record["points"] = len(points_to_bill)
+        record["start_date"] = start_date
+        record["end_date"] = end_date
+        _ = execute_billing_job(query_client, query, job_config)
 
     logger.info(f"Loaded {len(points_to_bill)} rows into {DATASET_ID}.{BILLING_TABLE_NAME}.")
 
+    invoiced_rows = list(execute_billing_job(query_client, get_invoiced_rows_query(), job_config))
+    invoiced_count = invoiced_rows[0]["invoiced_count"] if invoiced_rows else 0
+    if invoiced_count > 0:
+        logger.warning(f"Skipped {invoiced_count} invoiced rows from {start_date} to {end_date}, invalidate them "
+                       f"to bill the points again.")
+
+
+def pull_billing_events(subscriber: pubsub_v1.SubscriberClient, subscription_path: str) -> List[Any]:
+    """
+    Pulls messages from the billing subscription until the batch window elapses, the batch is full or the
+    subscription is drained.
+    :param subscriber: SubscriberClient
+        A client to pull messages with.
+    :param subscription_path: str
+        Full path of the subscription to pull from.
+    :return: List[ReceivedMessage]
+        Returns the pulled messages.
+    """
+
+    received_messages: List[Any] = []
+    deadline = time.monotonic() + BATCH_WINDOW_SECONDS
+    while len(received_messages) < BATCH_MAX_MESSAGES and time.monotonic() < deadline:
+        max_messages = min(PULL_MAX_MESSAGES, BATCH_MAX_MESSAGES - len(received_messages))
+        try:
+            response = subscriber.pull(
+                request={"subscription": subscription_path, "max_messages": max_messages},
+                timeout=PULL_TIMEOUT_SECONDS,
+            )
+        except exceptions.DeadlineExceeded:
+            # a pull on an empty subscription can time out instead of returning no messages
+            break
+        if len(response.received_messages) <= 0:
+            break
+        received_messages.extend(response.received_messages)
+    return received_messages
+
 
-def extract_date_range(data: Dict[str, str]) -> tuple[str, str]:
+def group_events_by_period(
+    received_messages: List[Any],
+) -> tuple[Dict[tuple[str, str], tuple[List[str], List[str]]], List[str]]:
+    """
+    Groups pulled billing events by their billing period. Events without an explicit period are billed for the month
+    before the one they were published in. Events that are not a JSON object with a list of point ids are logged and
+    returned separately, so they can be acknowledged instead of being redelivered forever.
+    :param received_messages: List[ReceivedMessage]
+        Messages pulled from the billing subscription.
+    :return: tuple[Dict[tuple[str,str], tuple[List[str],List[str]]], List[str]]
+        Returns the unique point ids and the ack ids of the events for every (start date, end date) period and the
+        ack ids of invalid events.
+    """
+
+    periods: Dict[tuple[str, str], tuple[List[str], List[str]]] = {}
+    invalid_ack_ids = []
+    for received_message in received_messages:
+        data = parse_billing_event(received_message.message.data)
+        if data is None:
+            logger.error(f"Dropping invalid billing event {received_message.message.data!r}")
+            invalid_ack_ids.append(received_message.ack_id)
+            continue
+        period = extract_date_range(data, received_message.message.publish_time)
+        points_to_bill, ack_ids = periods.setdefault(period, ([], []))
+        points_to_bill.extend(data.get(POINT_ID_PARAM, []))
+        ack_ids.append(received_message.ack_id)
+    periods = {
+        period: (list(dict.fromkeys(points_to_bill)), ack_ids) for period, (points_to_bill, ack_ids) in periods.items()
+    }
+    return periods, invalid_ack_ids
+
+
+def parse_billing_event(json_data: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Parses the payload of a billing event.
+    :param json_data: bytes
+        The JSON payload of the event.
+    :return: Optional[Dict[str,Any]]
+        Returns the event or None if it is not a JSON object with a list of point ids.
+    """
+
+    try:
+        data = json.loads(json_data)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get(POINT_ID_PARAM, []), list):
+        return None
+    return data
+
+
+def extract_date_range(data: Dict[str, str], event_time: Optional[datetime] = None) -> tuple[str, str]:
     """
     Returns start and end time extracted from the event received or replaces with default values for previous month.
     :param data: Dict[str,str]
         Contains the event received in json format.
+    :param event_time: Optional[datetime]
+        The time the event was published at, the previous month is relative to it. Defaults to the current time.
     :return: tuple [str,str]
         Returns a tuple of the start and end date for the billing.
     """
-    today = datetime.utcnow()
+    today = event_time.astimezone(DEFAULT_TIMEZONE) if event_time is not None else datetime.utcnow()
     end_date = datetime(today.year, today.month, 1, tzinfo=DEFAULT_TIMEZONE)
     last_month = end_date - timedelta(hours=1)
     start_date = datetime(last_month.year, last_month.month, 1, tzinfo=DEFAULT_TIMEZONE)
@@ -79,8 +242,7 @@ def extract_date_range(data: Dict[str, str]) -> tuple[str, str]:
 def get_job_config(point_ids: List[str], start_date: str, end_date: str) -> bigquery.QueryJobConfig:
     """
     Creates the job configuration required for the billing job. It requires setting parameters for points to fetch data
-    for, start and end date as well as a result target table. Destination is currently controlled by a constant in
-    settings.py
+    for as well as start and end date. The billing query merges its result into the billing table itself.
     :param point_ids: List[str]
         List of metering point ids that should be billed.
     :param start_date: str
@@ -97,20 +259,22 @@ def get_job_config(point_ids: List[str], start_date: str, end_date: str) -> bigq
 
     job_config = bigquery.QueryJobConfig(query_parameters=query_params)
 
-    job_config.destination = f"{PROJECT_ID}.{DATASET_ID}.{BILLING_TABLE_NAME}"
-    job_config.write_disposition = "WRITE_APPEND"
-
     return job_config
 
 
 def get_billing_query() -> str:
     """
-    Function to fetch the billing query with its necessary parameters
+    Function to fetch the billing query with its necessary parameters. The result is merged into the billing table on
+    point and period, so re-running a job, e.g. for a redelivered event, updates the rows instead of duplicating them.
+    Rows that are already invoiced are left unchanged. Invalidated rows are never matched, so re-billing a point after
+    its invoiced row was invalidated inserts a new row.
     :return: str
         Returns the parametrized query to run for billing
     """
 
     return f"""
+    MERGE `{PROJECT_ID}.{DATASET_ID}.{BILLING_TABLE_NAME}` AS target
+    USING (
     WITH
         billing_data AS (
         SELECT
@@ -149,6 +313,49 @@ def get_billing_query() -> str:
         FALSE AS is_invalidated,
     FROM
         billing_data_with_duty
+    ) AS source
+    ON
+        target.point_id = source.point_id
+        AND target.start_time = source.start_time
+        AND target.end_time = source.end_time
+        AND NOT target.is_invalidated
+    WHEN MATCHED AND NOT target.is_invoiced THEN
+        UPDATE SET
+            consumption_kwh = source.consumption_kwh,
+            consumption_mwh = source.consumption_mwh,
+            energy_price = source.energy_price,
+            markup = source.markup,
+            duty = source.duty,
+            total_price = source.total_price,
+            is_invalidated = source.is_invalidated
+    WHEN NOT MATCHED THEN
+        INSERT (point_id, start_time, end_time, consumption_kwh, consumption_mwh, energy_price, markup, duty,
+                total_price, is_invoiced, is_invalidated)
+        VALUES (source.point_id, source.start_time, source.end_time, source.consumption_kwh, source.consumption_mwh,
+                source.energy_price, source.markup, source.duty, source.total_price, source.is_invoiced,
+                source.is_invalidated)
+    """  # noqa: S608 Ignoring since parameters are controlled via query params
+
+
+def get_invoiced_rows_query() -> str:
+    """
+    Function to fetch the query counting the rows of a billing job that the billing query leaves unchanged, because
+    they are already invoiced and not invalidated.
+    :return: str
+        Returns the parametrized query to run with the job configuration of the billing job
+    """
+
+    return f"""
+    SELECT
+        COUNT(*) AS invoiced_count
+    FROM
+        `{PROJECT_ID}.{DATASET_ID}.{BILLING_TABLE_NAME}`
+    WHERE
+        point_id IN UNNEST(@{POINT_ID_PARAM})
+        AND start_time = PARSE_DATETIME("%F %X",@{START_DATE_PARAM})
+        AND end_time = PARSE_DATETIME("%F %X",@{END_DATE_PARAM})
+        AND is_invoiced
+        AND NOT is_invalidated
     """  # noqa: S608 Ignoring since parameters are controlled via query params
 
 
@@ -180,3 +387,15 @@ def get_big_query_client() -> bigquery.Client:
     if BIG_QUERY_CLIENT is None:
         BIG_QUERY_CLIENT = bigquery.Client()
     return BIG_QUERY_CLIENT
+
+
+def get_subscriber_client() -> pubsub_v1.SubscriberClient:
+    """
+    Utility function to fetch pubsub subscriber client instance if it is not already initialized in the global scope
+    :return: pubsub_v1.SubscriberClient
+        Returns a subscriber client global for the invocation of the function
+    """
+    global SUBSCRIBER_CLIENT
+    if SUBSCRIBER_CLIENT is None:
+        SUBSCRIBER_CLIENT = pubsub_v1.SubscriberClient()
+    return SUBSCRIBER_CLIENT
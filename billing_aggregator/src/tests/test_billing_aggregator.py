@@ -1,2 +1,151 @@
+from datetime import datetime, timezone
+import json
+from unittest.mock import Mock, patch
+
+from google.api_core import exceptions
+
+from main import (
+    bill_points,
+    billing_batch_aggregator,
+    END_DATE_PARAM,
+    extract_date_range,
+    get_billing_query,
+    get_job_config,
+    group_events_by_period,
+    POINT_ID_PARAM,
+    START_DATE_PARAM,
+)
+
+
 def test_billing_aggregator():
     pass
+
+
+def make_received_message(ack_id, data, publish_time=None):
+    payload = data if isinstance(data, bytes) else json.dumps(data).encode()
+    return Mock(ack_id=ack_id, message=Mock(data=payload, publish_time=publish_time or datetime.now(timezone.utc)))
+
+
+def test_group_events_by_period_coalesces_points_per_period():
+    default_period = extract_date_range({})
+    received_messages = [
+        make_received_message("ack-1", {POINT_ID_PARAM: ["p1", "p2"]}),
+        make_received_message("ack-2", {POINT_ID_PARAM: ["p2", "p3"]}),
+        make_received_message("ack-3", {POINT_ID_PARAM: ["p4"], START_DATE_PARAM: "2023-01-01 00:00:00",
+                                        END_DATE_PARAM: "2023-02-01 00:00:00"}),
+    ]
+
+    periods, invalid_ack_ids = group_events_by_period(received_messages)
+
+    assert periods == {
+        default_period: (["p1", "p2", "p3"], ["ack-1", "ack-2"]),
+        ("2023-01-01 00:00:00", "2023-02-01 00:00:00"): (["p4"], ["ack-3"]),
+    }
+    assert invalid_ack_ids == []
+
+
+def test_group_events_by_period_uses_publish_time_for_default_period():
+    received_messages = [
+        make_received_message("ack-1", {POINT_ID_PARAM: ["p1"]},
+                              datetime(2023, 1, 31, 23, 59, 59, tzinfo=timezone.utc)),
+        make_received_message("ack-2", {POINT_ID_PARAM: ["p2"]},
+                              datetime(2023, 2, 1, 0, 0, 1, tzinfo=timezone.utc)),
+    ]
+
+    periods, _ = group_events_by_period(received_messages)
+
+    assert periods == {
+        ("2022-12-01 00:00:00", "2023-01-01 00:00:00"): (["p1"], ["ack-1"]),
+        ("2023-01-01 00:00:00", "2023-02-01 00:00:00"): (["p2"], ["ack-2"]),
+    }
+
+
+def test_group_events_by_period_returns_invalid_events_separately():
+    received_messages = [
+        make_received_message("ack-1", b"not json"),
+        make_received_message("ack-2", ["p1"]),
+        make_received_message("ack-3", {POINT_ID_PARAM: ["p1"]}),
+    ]
+
+    periods, invalid_ack_ids = group_events_by_period(received_messages)
+
+    assert list(periods.values()) == [(["p1"], ["ack-3"])]
+    assert invalid_ack_ids == ["ack-1", "ack-2"]
+
+
+def test_billing_query_merges_into_billing_table():
+    job_config = get_job_config(["p1"], "2023-01-01 00:00:00", "2023-02-01 00:00:00")
+
+    assert job_config.destination is None
+    assert get_billing_query().strip().startswith("MERGE")
+    assert "AND NOT target.is_invalidated" in get_billing_query()
+
+
+@patch("main.execute_billing_job")
+@patch("main.get_big_query_client")
+def test_bill_points_logs_skipped_invoiced_rows(mock_get_big_query_client, mock_execute_billing_job, caplog):
+    mock_execute_billing_job.side_effect = [iter([]), iter([{"invoiced_count": 2}])]
+
+    bill_points(["p1", "p2"], "2023-01-01 00:00:00", "2023-02-01 00:00:00")
+
+    assert mock_execute_billing_job.call_count == 2
+    assert "Skipped 2 invoiced rows from 2023-01-01 00:00:00 to 2023-02-01 00:00:00" in caplog.text
+
+
+@patch("main.bill_points")
+@patch("main.get_subscriber_client")
+def test_billing_batch_aggregator_runs_one_job_per_period(mock_get_subscriber_client, mock_bill_points):
+    subscriber = mock_get_subscriber_client.return_value
+    subscriber.subscription_path.return_value = "subscription"
+    subscriber.pull.side_effect = [
+        Mock(received_messages=[make_received_message("ack-1", {POINT_ID_PARAM: ["p1"]}),
+                                make_received_message("ack-2", {POINT_ID_PARAM: ["p2"]}),
+                                make_received_message("ack-3", b"{")]),
+        Mock(received_messages=[]),
+    ]
+
+    result = billing_batch_aggregator(Mock())
+
+    mock_bill_points.assert_called_once_with(["p1", "p2"], *extract_date_range({}))
+    assert [call.kwargs["request"]["ack_ids"] for call in subscriber.acknowledge.call_args_list] == [
+        ["ack-3"],
+        ["ack-1", "ack-2"],
+    ]
+    assert result == "Billed 2 events in 1 jobs, failed 0 jobs, dropped 1 invalid events"
+
+
+@patch("main.bill_points")
+@patch("main.get_subscriber_client")
+def test_billing_batch_aggregator_continues_after_failed_job(mock_get_subscriber_client, mock_bill_points):
+    subscriber = mock_get_subscriber_client.return_value
+    subscriber.subscription_path.return_value = "subscription"
+    subscriber.pull.side_effect = [
+        Mock(received_messages=[make_received_message("ack-1", {POINT_ID_PARAM: ["p1"], START_DATE_PARAM: "2023-13-01",
+                                                                 END_DATE_PARAM: "2023-14-01"}),
+                                make_received_message("ack-2", {POINT_ID_PARAM: ["p2"]})]),
+        Mock(received_messages=[]),
+    ]
+    mock_bill_points.side_effect = [exceptions.BadRequest("Failed to parse input string"), None]
+
+    result = billing_batch_aggregator(Mock())
+
+    assert mock_bill_points.call_count == 2
+    assert [call.kwargs["request"]["ack_ids"] for call in subscriber.acknowledge.call_args_list] == [["ack-2"]]
+    assert result == "Billed 1 events in 1 jobs, failed 1 jobs, dropped 0 invalid events"
+
+
+@patch("main.bill_points")
+@patch("main.get_subscriber_client")
+def test_billing_batch_aggregator_treats_pull_timeout_as_drained(mock_get_subscriber_client, mock_bill_points):
+    subscriber = mock_get_subscriber_client.return_value
+    subscriber.subscription_path.return_value = "subscription"
+    subscriber.pull.side_effect = [
+        Mock(received_messages=[make_received_message("ack-1", {POINT_ID_PARAM: ["p1"]})]),
+        exceptions.DeadlineExceeded("Deadline Exceeded"),
+    ]
+
+    result = billing_batch_aggregator(Mock())
+
+    assert subscriber.pull.call_count == 2
+    mock_bill_points.assert_called_once_with(["p1"], *extract_date_range({}))
+    assert result == "Billed 1 events in 1 jobs, failed 0 jobs, dropped 0 invalid events"
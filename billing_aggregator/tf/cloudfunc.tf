@@ -19,18 +19,28 @@ resource "google_cloudfunctions_function" "function" {
   service_account_email = google_service_account.service_account.email
 
   environment_variables = {
-    CURRENT_ENV = replace(replace(terraform.workspace, "toki-data-platform", ""), "-", "")
-    PROJECT_ID  = terraform.workspace
+    CURRENT_ENV          = replace(replace(terraform.workspace, "toki-data-platform", ""), "-", "")
+    PROJECT_ID           = terraform.workspace
+    BILLING_SUBSCRIPTION = "billing-batch-${terraform.workspace}"
+    BATCH_WINDOW_SECONDS = var.batch_window_seconds
+    BATCH_MAX_MESSAGES   = var.batch_max_messages
   }
 
   available_memory_mb   = 256
+  # Covers the pull window plus one billing job per period and stays below the scheduler attempt_deadline
+  timeout               = 300
   source_archive_bucket = google_storage_bucket.bucket.name
   source_archive_object = google_storage_bucket_object.archive.name
-  entry_point           = var.function_name
+  entry_point           = var.coalesce_events ? "billing_batch_aggregator" : var.function_name
+  trigger_http          = var.coalesce_events ? true : null
 
-  event_trigger {
-    event_type = "google.pubsub.topic.publish"
-    resource   = data.google_pubsub_topic.billing-trigger.id
+  # In coalescing mode events are pulled from a subscription by a scheduled run instead of pushed one by one
+  dynamic "event_trigger" {
+    for_each = var.coalesce_events ? [] : [1]
+    content {
+      event_type = "google.pubsub.topic.publish"
+      resource   = data.google_pubsub_topic.billing-trigger.id
+    }
   }
 }
 
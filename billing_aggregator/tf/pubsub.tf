@@ -1,3 +1,78 @@
 data "google_pubsub_topic" "billing-trigger" {
   name = "billing-trigger-${terraform.workspace}"
 }
+
+data "google_project" "project" {}
+
+resource "google_pubsub_topic" "billing-dead-letter" {
+  count = var.coalesce_events ? 1 : 0
+  name  = "billing-dead-letter-${terraform.workspace}"
+}
+
+resource "google_pubsub_subscription" "billing-dead-letter" {
+  count = var.coalesce_events ? 1 : 0
+  name  = "billing-dead-letter-${terraform.workspace}"
+  topic = google_pubsub_topic.billing-dead-letter[0].id
+}
+
+resource "google_pubsub_subscription" "billing-batch" {
+  count                = var.coalesce_events ? 1 : 0
+  name                 = "billing-batch-${terraform.workspace}"
+  topic                = data.google_pubsub_topic.billing-trigger.id
+  ack_deadline_seconds = 600
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.billing-dead-letter[0].id
+    max_delivery_attempts = var.max_delivery_attempts
+  }
+}
+
+resource "google_pubsub_topic_iam_member" "billing_dead_letter_publisher" {
+  count  = var.coalesce_events ? 1 : 0
+  topic  = google_pubsub_topic.billing-dead-letter[0].name
+  role   = "roles/pubsub.publisher"
+  member = "serviceAccount:service-${data.google_project.project.number}@gcp-sa-pubsub.iam.gserviceaccount.com"
+}
+
+resource "google_pubsub_subscription_iam_member" "billing_batch_dead_letter_subscriber" {
+  count        = var.coalesce_events ? 1 : 0
+  subscription = google_pubsub_subscription.billing-batch[0].name
+  role         = "roles/pubsub.subscriber"
+  member       = "serviceAccount:service-${data.google_project.project.number}@gcp-sa-pubsub.iam.gserviceaccount.com"
+}
+
+resource "google_pubsub_subscription_iam_member" "billing_batch_subscriber" {
+  count        = var.coalesce_events ? 1 : 0
+  subscription = google_pubsub_subscription.billing-batch[0].name
+  role         = "roles/pubsub.subscriber"
+  member       = "serviceAccount:${google_service_account.service_account.email}"
+}
+
+resource "google_cloudfunctions_function_iam_member" "billing_batch_invoker" {
+  count          = var.coalesce_events ? 1 : 0
+  project        = google_cloudfunctions_function.function.project
+  region         = google_cloudfunctions_function.function.region
+  cloud_function = google_cloudfunctions_function.function.name
+
+  role   = "roles/cloudfunctions.invoker"
+  member = "serviceAccount:${google_service_account.service_account.email}"
+}
+
+resource "google_cloud_scheduler_job" "billing_batch" {
+  count            = var.coalesce_events ? 1 : 0
+  paused           = false
+  name             = "${local.aligned_name}-batch"
+  description      = "Trigger the ${google_cloudfunctions_function.function.name} Cloud Function to bill coalesced events."
+  schedule         = var.batch_schedule
+  time_zone        = "Europe/Dublin"
+  attempt_deadline = "320s"
+
+  http_target {
+    http_method = "GET"
+    uri         = google_cloudfunctions_function.function.https_trigger_url
+
+    oidc_token {
+      service_account_email = google_service_account.service_account.email
+    }
+  }
+}
@@ -2,3 +2,30 @@ variable "function_name" {
   type    = string
   default = "billing_aggregator"
 }
+
+variable "coalesce_events" {
+  type        = bool
+  default     = false
+  description = "Pull billing events on a schedule and run one billing job per period instead of one job per event"
+}
+
+variable "batch_schedule" {
+  type    = string
+  default = "*/5 * * * *"
+}
+
+variable "batch_window_seconds" {
+  type    = number
+  default = 30
+}
+
+variable "batch_max_messages" {
+  type    = number
+  default = 1000
+}
+
+variable "max_delivery_attempts" {
+  type        = number
+  default     = 5
+  description = "Deliveries of a billing event before it is moved to the billing-dead-letter topic, between 5 and 100"
+}
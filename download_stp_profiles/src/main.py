@@ -10,6 +10,7 @@ from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 from toki_storage.storage_service import StorageService
+from toki_tracing.tracing import span, traced
 
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
@@ -24,19 +25,28 @@ bucket = None
 STORAGE_SERVICE = None
 
 
+@traced(logger)
 def download_stp_profiles(request):
     now = str(datetime.now().year)
     stp_folder_name = f"STP-profile-weights-{now}"
-    stp_target_folder = get_stp_weights_folder(stp_folder_name)
+    with span("get_stp_weights_folder"):
+        stp_target_folder = get_stp_weights_folder(stp_folder_name)
     if stp_target_folder is not None:
-        folder_list = list_xlsx_items_gdrive(stp_target_folder, FOLDER_TYPE)
+        with span("list_folders"):
+            folder_list = list_xlsx_items_gdrive(stp_target_folder, FOLDER_TYPE)
         for folder_info in folder_list:
             erp_folder_name = folder_info["name"]
             erp_folder_id = folder_info["id"]
-            files_list = list_xlsx_items_gdrive(erp_folder_id, FILE_TYPE)
+            with span("list_files") as record:
+                record["erp"] = erp_folder_name
+                files_list = list_xlsx_items_gdrive(erp_folder_id, FILE_TYPE)
             for single_file in files_list:
-                download_data_dict = download_bytesio_gdrive(single_file)
-                upload_gsc(download_data_dict, now, erp_folder_name)
+                with span("download") as record:
+                    record["file"] = single_file["name"]
+                    download_data_dict = download_bytesio_gdrive(single_file)
+                with span("upload") as record:
+                    record["file"] = single_file["name"]
+                    upload_gsc(download_data_dict, now, erp_folder_name)
     return "function run complete"
 
 
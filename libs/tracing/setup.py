@@ -0,0 +1,9 @@
+from setuptools import find_packages, setup
+
+setup(
+    name="toki-tracing",
+    version="0.1.0",
+    description="Per-stage tracing and opt-in profiling for Cloud Function entry points",
+    packages=find_packages(exclude=["tests"]),
+    python_requires=">=3.10",
+)
@@ -0,0 +1,107 @@
+import json
+import unittest
+from unittest.mock import Mock, patch
+
+from toki_tracing import tracing
+from toki_tracing.tracing import span, traced
+
+
+def get_records(mock_logger):
+    return [json.loads(call.args[0]) for call in mock_logger.info.call_args_list]
+
+
+class TestTracing(unittest.TestCase):
+    def test_span_logs_stage_with_invocation_id(self):
+        # Given
+        mock_logger = Mock()
+
+        @traced(mock_logger)
+        def entry_point(request):
+            with span("stage") as record:
+                record["rows"] = 2
+            return "OK"
+
+        # When
+        result = entry_point("")
+        actual_records = get_records(mock_logger)
+
+        # Then
+        self.assertEqual("OK", result)
+        self.assertEqual(["stage", "entry_point"], [record["span"] for record in actual_records])
+        self.assertEqual(1, len({record["invocation_id"] for record in actual_records}))
+        self.assertIsNotNone(actual_records[0]["invocation_id"])
+        self.assertEqual(2, actual_records[0]["rows"])
+        self.assertIn("duration_ms", actual_records[0])
+        self.assertIn("max_rss_growth_kb", actual_records[0])
+        self.assertIsNone(tracing.INVOCATION_ID)
+        self.assertIs(tracing.DEFAULT_LOGGER, tracing.LOGGER)
+
+    def test_traced_uses_execution_id_header_of_http_request(self):
+        # Given
+        mock_logger = Mock()
+        request = Mock(headers={"Function-Execution-Id": "http-execution-id"})
+
+        @traced(mock_logger)
+        def entry_point(request):
+            return "OK"
+
+        # When
+        entry_point(request)
+
+        # Then
+        self.assertEqual("http-execution-id", get_records(mock_logger)[0]["invocation_id"])
+
+    def test_traced_uses_event_id_of_event_context(self):
+        # Given
+        mock_logger = Mock()
+        context = Mock(event_id="pubsub-event-id")
+
+        @traced(mock_logger)
+        def entry_point(event, context):
+            return None
+
+        # When
+        entry_point({"data": ""}, context)
+
+        # Then
+        self.assertEqual("pubsub-event-id", get_records(mock_logger)[0]["invocation_id"])
+
+    @patch("toki_tracing.tracing.PROFILING_THRESHOLD_SECONDS", 0)
+    @patch("toki_tracing.tracing.PROFILING_ENABLED", True)
+    def test_traced_logs_profile_for_slow_invocation(self):
+        # Given
+        mock_logger = Mock()
+
+        @traced(mock_logger)
+        def entry_point():
+            return "OK"
+
+        # When
+        entry_point()
+        actual_records = get_records(mock_logger)
+
+        # Then
+        self.assertEqual("entry_point", actual_records[-1]["profile"])
+        self.assertIn("function calls", actual_records[-1]["stats"])
+
+    @patch("toki_tracing.tracing.TRACE_MEMORY", True)
+    def test_span_logs_peak_memory_per_stage(self):
+        # Given
+        mock_logger = Mock()
+
+        @traced(mock_logger)
+        def entry_point():
+            with span("allocate"):
+                buffer = bytearray(4 * 1024 * 1024)
+                del buffer
+            with span("idle"):
+                pass
+
+        # When
+        entry_point()
+        actual_records = {record["span"]: record for record in get_records(mock_logger)}
+
+        # Then
+        self.assertGreaterEqual(actual_records["allocate"]["peak_memory_kb"], 4096)
+        self.assertLess(actual_records["idle"]["peak_memory_kb"], 64)
+        self.assertGreaterEqual(actual_records["entry_point"]["peak_memory_kb"], 4096)
@@ -0,0 +1,142 @@
+import cProfile
+from contextlib import contextmanager
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Sequence
+import uuid
+
+DEFAULT_LOGGER = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_THRESHOLD_SECONDS = float(os.getenv("PROFILING_THRESHOLD_SECONDS", "30"))
+PROFILING_STATS_LIMIT = 30
+TRACE_MEMORY = os.getenv("TRACE_MEMORY", "false").lower() == "true"
+EXECUTION_ID_HEADER = "Function-Execution-Id"
+INVOCATION_ID = None
+LOGGER = DEFAULT_LOGGER
+SPAN_PEAKS: List[int] = []
+
+
+def traced(logger: logging.Logger = None) -> Callable[[Callable], Callable]:
+    """
+    Decorator factory for function entry points. Every span logged during the call goes through the given logger
+    and carries the invocation id of the call, which is the platform execution id when the entry point receives
+    one. Allocations are traced when TRACE_MEMORY is set and, when PROFILING_ENABLED is set, a profile is dumped
+    for invocations slower than PROFILING_THRESHOLD_SECONDS
+      Parameters:
+        logger: logging.Logger
+            logger of the function, defaults to the logger of this module
+      Returns:
+        Callable[[Callable], Callable]:
+            decorator instrumenting an entry point
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            global INVOCATION_ID, LOGGER
+            INVOCATION_ID = get_invocation_id(args)
+            LOGGER = logger or DEFAULT_LOGGER
+            if TRACE_MEMORY and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            profiler = cProfile.Profile() if PROFILING_ENABLED else None
+            if profiler is not None:
+                profiler.enable()
+            try:
+                with span(function.__name__) as record:
+                    return function(*args, **kwargs)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                    if record["duration_ms"] >= PROFILING_THRESHOLD_SECONDS * 1000:
+                        log_profile(profiler, function.__name__)
+                if TRACE_MEMORY:
+                    tracemalloc.stop()
+                INVOCATION_ID = None
+                LOGGER = DEFAULT_LOGGER
+
+        return wrapper
+
+    return decorator
+
+
+def get_invocation_id(args: Sequence[Any]) -> str:
+    """
+    Find the platform execution id in the arguments of an entry point: the Function-Execution-Id header of an HTTP
+    request or the event_id of an event context. A random id is used when neither is available
+    """
+    for arg in args:
+        event_id = getattr(arg, "event_id", None)
+        if isinstance(event_id, str) and event_id:
+            return event_id
+        headers = getattr(arg, "headers", None)
+        execution_id = headers.get(EXECUTION_ID_HEADER) if headers is not None else None
+        if isinstance(execution_id, str) and execution_id:
+            return execution_id
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def span(name: str) -> Iterator[Dict[str, Any]]:
+    """
+    Time a stage of the invocation and emit it as a structured JSON log line. The record contains the growth of the
+    process RSS high-water mark during the stage and, while allocations are traced, the peak of memory allocated
+    by the stage, including nested spans
+      Parameters:
+        name: str
+            name of the stage
+      Returns:
+        Iterator[Dict[str, Any]]:
+            the span record, which the caller can enrich with extra fields before it is logged
+    """
+    record: Dict[str, Any] = {"invocation_id": INVOCATION_ID, "span": name}
+    is_tracing_memory = tracemalloc.is_tracing()
+    if is_tracing_memory:
+        start_memory = enter_memory_span()
+    start_max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        record["max_rss_growth_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_max_rss
+        if is_tracing_memory:
+            record["peak_memory_kb"] = (exit_memory_span() - start_memory) // 1024
+        LOGGER.info(json.dumps(record, default=str))
+
+
+def enter_memory_span() -> int:
+    """
+    Reset the traced peak for a new span, keeping the peak reached so far by the enclosing span
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    if SPAN_PEAKS:
+        SPAN_PEAKS[-1] = max(SPAN_PEAKS[-1], peak)
+    SPAN_PEAKS.append(current)
+    tracemalloc.reset_peak()
+    return current
+
+
+def exit_memory_span() -> int:
+    """
+    Return the traced peak of the closing span and pass it on to the enclosing span
+    """
+    _, peak = tracemalloc.get_traced_memory()
+    peak = max(peak, SPAN_PEAKS.pop())
+    if SPAN_PEAKS:
+        SPAN_PEAKS[-1] = max(SPAN_PEAKS[-1], peak)
+    return peak
+
+
+def log_profile(profiler: cProfile.Profile, name: str) -> None:
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILING_STATS_LIMIT)
+    LOGGER.info(json.dumps({"invocation_id": INVOCATION_ID, "profile": name, "stats": stream.getvalue()}))
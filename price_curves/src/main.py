@@ -0,0 +1,236 @@
+from collections import OrderedDict
+from datetime import date
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple, Union
+
+from google.cloud import bigquery
+import numpy as np
+import pandas as pd
+from toki_tracing.tracing import span, traced
+
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+logger = logging.getLogger()
+
+PROJECT_ID = os.getenv("PROJECT_ID", "toki-data-platform-dev")
+PRICES_TABLE_ID = "clean.prices_v2"
+LOCAL_TIMEZONE = "Europe/Sofia"
+COUNTRY_CODE_PARAM = "country_code"
+START_DATE_PARAM = "start_date"
+END_DATE_PARAM = "end_date"
+CACHE_MAX_DAYS = int(os.getenv("PRICE_CURVE_CACHE_MAX_DAYS", "2048"))
+UNFINALIZED_TTL_SECONDS = float(os.getenv("PRICE_CURVE_UNFINALIZED_TTL_SECONDS", "300"))
+# a single request can fill at most half of the cache, so it cannot evict every other cached day
+MAX_RANGE_DAYS = min(int(os.getenv("PRICE_CURVE_MAX_RANGE_DAYS", "366")), CACHE_MAX_DAYS // 2)
+EMPTY_CURVE = (
+    np.array([], dtype="datetime64[ns]"),
+    np.array([], dtype=np.float64),
+)
+EMPTY_PRICE_ROWS = EMPTY_CURVE + (np.array([], dtype="datetime64[D]"),)
+PRICE_CURVE_CACHE = None
+BIG_QUERY_CLIENT = None
+
+
+@traced(logger)
+def price_curves(request) -> Union[Dict[str, Any], Tuple[str, int]]:
+    """
+    HTTP entry point returning the day-ahead price curve of a country for a range of market dates. Warm instances
+    serve repeated and overlapping requests from the in-memory cache.
+      Parameters:
+        request: flask.Request
+            JSON body with country_code, start_date and end_date as YYYY-MM-DD, end_date inclusive
+      Returns:
+        Union[Dict[str, Any], Tuple[str, int]]:
+            UTC timestamps as epoch seconds and prices, ordered by timestamp,
+            or an error message with status 400 for an invalid request
+    """
+    try:
+        country_code, start_date, end_date = parse_price_curve_request(request.get_json(silent=True))
+    except ValueError as error:
+        logger.warning(f"Invalid price curve request: {error}")
+        return str(error), 400
+    with span("get_price_curve") as record:
+        record["country_code"] = country_code
+        timestamps, prices = get_price_curve(country_code, start_date, end_date)
+        record["points"] = len(prices)
+    return {
+        COUNTRY_CODE_PARAM: country_code,
+        "timestamps": (timestamps.astype("datetime64[s]").astype(np.int64)).tolist(),
+        "prices": prices.tolist(),
+    }
+
+
+def parse_price_curve_request(request_data: Any) -> Tuple[str, date, date]:
+    """
+    Read country_code, start_date and end_date from a price curve request body, raising ValueError with a message
+    for the caller when the body is not a JSON object, a parameter is missing or invalid, start_date is after
+    end_date or the range is longer than MAX_RANGE_DAYS
+    """
+    if not isinstance(request_data, dict):
+        raise ValueError("Request body must be a JSON object")
+    missing_params = [
+        param for param in (COUNTRY_CODE_PARAM, START_DATE_PARAM, END_DATE_PARAM) if param not in request_data
+    ]
+    if missing_params:
+        raise ValueError(f"Missing parameters: {', '.join(missing_params)}")
+    country_code = request_data[COUNTRY_CODE_PARAM]
+    if not isinstance(country_code, str) or not country_code:
+        raise ValueError(f"{COUNTRY_CODE_PARAM} must be a non-empty string")
+    start_date, end_date = (parse_date(request_data, param) for param in (START_DATE_PARAM, END_DATE_PARAM))
+    if start_date > end_date:
+        raise ValueError(f"{START_DATE_PARAM} {start_date} is after {END_DATE_PARAM} {end_date}")
+    range_days = (end_date - start_date).days + 1
+    if range_days > MAX_RANGE_DAYS:
+        raise ValueError(f"Range of {range_days} days is longer than the maximum of {MAX_RANGE_DAYS} days")
+    return country_code, start_date, end_date
+
+
+def parse_date(request_data: Dict[str, Any], param: str) -> date:
+    try:
+        return date.fromisoformat(request_data[param])
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"{param} must be a date as YYYY-MM-DD, got {request_data[param]!r}") from error
+
+
+class PriceCurveCache:
+    """
+    Size bounded LRU cache of day-ahead price curves keyed by (country_code, market date).
+    Days before today (Europe/Sofia) are final and never expire, today, tomorrow and days without prices expire after
+    UNFINALIZED_TTL_SECONDS since prices for them can still be published or corrected.
+    """
+
+    def __init__(self, max_days: int = CACHE_MAX_DAYS, unfinalized_ttl: float = UNFINALIZED_TTL_SECONDS):
+        self.max_days = max_days
+        self.unfinalized_ttl = unfinalized_ttl
+        self._days: OrderedDict = OrderedDict()
+
+    def get_price_curve(
+        self, country_code: str, start_date: date, end_date: date
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get hourly prices for a country for every market date between start_date and end_date inclusive
+          Parameters:
+            country_code: str
+                country code as defined in https://en.wikipedia.org/wiki/List_of_ISO_3166_country_codes
+            start_date: datetime.date
+                first market date of the curve
+            end_date: datetime.date
+                last market date of the curve
+          Returns:
+            Tuple[numpy.ndarray, numpy.ndarray]:
+                UTC timestamps as datetime64[ns] and prices as float64, ordered by timestamp
+        """
+        days = [day.date() for day in pd.date_range(start_date, end_date, freq="D")]
+        if not days:
+            return EMPTY_CURVE
+        curves = {day: self._lookup(country_code, day) for day in days}
+        missing_days = [day for day, curve in curves.items() if curve is None]
+        if missing_days:
+            curves.update(self._prefetch(country_code, missing_days))
+        return (
+            np.concatenate([curves[day][0] for day in days]),
+            np.concatenate([curves[day][1] for day in days]),
+        )
+
+    def clear(self) -> None:
+        self._days.clear()
+
+    def _lookup(self, country_code: str, day: date):
+        key = (country_code, day)
+        entry = self._days.get(key)
+        if entry is None:
+            return None
+        curve, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._days[key]
+            return None
+        self._days.move_to_end(key)
+        return curve
+
+    def _prefetch(self, country_code: str, days: List[date]) -> Dict[date, Tuple[np.ndarray, np.ndarray]]:
+        timestamps, prices, market_dates = query_prices(country_code, min(days), max(days))
+        today = pd.Timestamp.now(tz=LOCAL_TIMEZONE).date()
+        curves = {}
+        for day in days:
+            mask = market_dates == np.datetime64(day, "D")
+            curves[day] = (timestamps[mask], prices[mask])
+            is_final = day < today and mask.any()
+            expires_at = None if is_final else time.monotonic() + self.unfinalized_ttl
+            self._days[(country_code, day)] = (curves[day], expires_at)
+            self._days.move_to_end((country_code, day))
+        while len(self._days) > self.max_days:
+            self._days.popitem(last=False)
+        logger.info(f"Cached {len(days)} days of prices for {country_code} from {min(days)} to {max(days)}")
+        return curves
+
+
+def query_prices(
+    country_code: str, start_date: date, end_date: date
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fetch hourly prices for a range of market dates from the prices table in a single query. When an hour was
+    written more than once the most recently inserted price is used
+      Parameters:
+        country_code: str
+            country code as defined in https://en.wikipedia.org/wiki/List_of_ISO_3166_country_codes
+        start_date: datetime.date
+            first market date to fetch
+        end_date: datetime.date
+            last market date to fetch
+      Returns:
+        Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+            UTC timestamps as datetime64[ns], prices as float64 and market dates as datetime64[D],
+            ordered by timestamp
+    """
+    query = f"""
+    SELECT
+        timestamp,
+        price,
+        date
+    FROM
+        `{PROJECT_ID}.{PRICES_TABLE_ID}`
+    WHERE
+        country_code = @country_code
+        AND date BETWEEN @start_date AND @end_date
+    QUALIFY
+        ROW_NUMBER() OVER (PARTITION BY timestamp ORDER BY inserted_at DESC) = 1
+    ORDER BY
+        timestamp
+    """  # noqa: S608 Ignoring since parameters are controlled via query params
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("country_code", "STRING", country_code),
+            bigquery.ScalarQueryParameter("start_date", "DATE", start_date),
+            bigquery.ScalarQueryParameter("end_date", "DATE", end_date),
+        ]
+    )
+    rows = list(get_big_query_client().query(query, job_config=job_config).result())
+    if not rows:
+        return EMPTY_PRICE_ROWS
+    timestamps = pd.DatetimeIndex([row["timestamp"] for row in rows])
+    if timestamps.tz is not None:
+        timestamps = timestamps.tz_convert("UTC").tz_localize(None)
+    prices = np.array([row["price"] for row in rows], dtype=np.float64)
+    market_dates = np.array([row["date"] for row in rows], dtype="datetime64[D]")
+    return timestamps.to_numpy(dtype="datetime64[ns]"), prices, market_dates
+
+
+def get_price_curve(country_code: str, start_date: date, end_date: date) -> Tuple[np.ndarray, np.ndarray]:
+    return get_price_curve_cache().get_price_curve(country_code, start_date, end_date)
+
+
+def get_price_curve_cache() -> PriceCurveCache:
+    global PRICE_CURVE_CACHE
+    if PRICE_CURVE_CACHE is None:
+        PRICE_CURVE_CACHE = PriceCurveCache()
+    return PRICE_CURVE_CACHE
+
+
+def get_big_query_client():
+    global BIG_QUERY_CLIENT
+    if BIG_QUERY_CLIENT is None:
+        BIG_QUERY_CLIENT = bigquery.Client()
+    return BIG_QUERY_CLIENT
@@ -0,0 +1,137 @@
+import unittest
+from unittest.mock import MagicMock, Mock, patch
+
+import flask
+import numpy as np
+import pandas as pd
+
+from main import price_curves, PriceCurveCache
+
+
+class TestPriceCurveCache(unittest.TestCase):
+    def setUp(self):
+        self.first_day = pd.Timestamp("2022-11-30").date()
+        self.second_day = pd.Timestamp("2022-12-01").date()
+        self.expected_timestamps = np.array(
+            ["2022-11-29T22:00", "2022-11-29T23:00", "2022-11-30T22:00"], dtype="datetime64[ns]"
+        )
+        self.expected_prices = np.array([547.48, 450.25, 301.5])
+        self.expected_market_dates = np.array(["2022-11-30", "2022-11-30", "2022-12-01"], dtype="datetime64[D]")
+
+    @patch("main.query_prices")
+    def test_get_price_curve_prefetches_range_in_one_query(self, mock_query_prices):
+        # Given
+        mock_query_prices.return_value = (
+            self.expected_timestamps,
+            self.expected_prices,
+            self.expected_market_dates,
+        )
+        cache = PriceCurveCache()
+
+        # When
+        actual_timestamps, actual_prices = cache.get_price_curve("BG", self.first_day, self.second_day)
+        actual_first_day_timestamps, actual_first_day_prices = cache.get_price_curve(
+            "BG", self.first_day, self.first_day
+        )
+
+        # Then
+        self.assertEqual(1, mock_query_prices.call_count)
+        self.assertEqual(("BG", self.first_day, self.second_day), mock_query_prices.call_args.args)
+        np.testing.assert_array_equal(self.expected_timestamps, actual_timestamps)
+        np.testing.assert_array_equal(self.expected_prices, actual_prices)
+        np.testing.assert_array_equal(self.expected_timestamps[:2], actual_first_day_timestamps)
+        np.testing.assert_array_equal(self.expected_prices[:2], actual_first_day_prices)
+
+    @patch("main.query_prices")
+    def test_get_price_curve_evicts_least_recently_used_day(self, mock_query_prices):
+        # Given
+        mock_query_prices.return_value = (
+            self.expected_timestamps,
+            self.expected_prices,
+            self.expected_market_dates,
+        )
+        cache = PriceCurveCache(max_days=1)
+
+        # When
+        cache.get_price_curve("BG", self.first_day, self.first_day)
+        cache.get_price_curve("BG", self.second_day, self.second_day)
+        cache.get_price_curve("BG", self.first_day, self.first_day)
+
+        # Then
+        self.assertEqual(3, mock_query_prices.call_count)
+
+    @patch("main.time")
+    @patch("main.query_prices")
+    def test_get_price_curve_expires_unfinalized_days(self, mock_query_prices, mock_time):
+        # Given
+        today = pd.Timestamp.now(tz="Europe/Sofia").date()
+        mock_query_prices.return_value = (
+            self.expected_timestamps,
+            self.expected_prices,
+            self.expected_market_dates,
+        )
+        mock_time.monotonic = MagicMock(side_effect=[0, 301, 301])
+        cache = PriceCurveCache(unfinalized_ttl=300)
+
+        # When
+        cache.get_price_curve("BG", today, today)
+        cache.get_price_curve("BG", today, today)
+
+        # Then
+        self.assertEqual(2, mock_query_prices.call_count)
+
+    @patch("main.query_prices")
+    def test_get_price_curve_returns_empty_curve_for_reversed_range(self, mock_query_prices):
+        # Given
+        cache = PriceCurveCache()
+
+        # When
+        actual_timestamps, actual_prices = cache.get_price_curve("BG", self.second_day, self.first_day)
+
+        # Then
+        mock_query_prices.assert_not_called()
+        self.assertEqual(0, len(actual_timestamps))
+        self.assertEqual(0, len(actual_prices))
+
+    @patch("main.get_price_curve")
+    def test_price_curves_returns_curve_as_json(self, mock_get_price_curve):
+        # Given
+        mock_get_price_curve.return_value = (self.expected_timestamps[:2], self.expected_prices[:2])
+        request = Mock(spec=flask.Request)
+        request.get_json.return_value = {"country_code": "BG", "start_date": "2022-11-30", "end_date": "2022-11-30"}
+
+        # When
+        actual_response = price_curves(request)
+
+        # Then
+        self.assertEqual(("BG", self.first_day, self.first_day), mock_get_price_curve.call_args.args)
+        self.assertEqual(
+            {"country_code": "BG", "timestamps": [1669759200, 1669762800], "prices": [547.48, 450.25]},
+            actual_response,
+        )
+
+    @patch("main.get_price_curve")
+    def test_price_curves_rejects_invalid_requests(self, mock_get_price_curve):
+        # Given
+        invalid_requests = [
+            None,
+            {"country_code": "BG", "start_date": "2022-11-30"},
+            {"country_code": "BG", "start_date": "2022-13-01", "end_date": "2022-12-01"},
+            {"country_code": "BG", "start_date": 20221130, "end_date": "2022-12-01"},
+            {"country_code": None, "start_date": "2022-11-30", "end_date": "2022-12-01"},
+            {"country_code": "BG", "start_date": "2022-12-01", "end_date": "2022-11-30"},
+            {"country_code": "BG", "start_date": "2000-01-01", "end_date": "2022-12-01"},
+        ]
+
+        for request_data in invalid_requests:
+            with self.subTest(request_data=request_data):
+                request = Mock(spec=flask.Request)
+                request.get_json.return_value = request_data
+
+                # When
+                actual_message, actual_status = price_curves(request)
+
+                # Then
+                self.assertEqual(400, actual_status)
+                self.assertTrue(actual_message)
+        mock_get_price_curve.assert_not_called()
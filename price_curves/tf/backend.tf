@@ -0,0 +1,6 @@
+terraform {
+  backend "gcs" {
+    bucket = "toki-data-platform-terraform"
+    prefix = "state/price_curves"
+  }
+}
@@ -0,0 +1,54 @@
+data "google_storage_bucket" "source_bucket" {
+  name = "source_${terraform.workspace}"
+}
+
+resource "google_storage_bucket_object" "archive" {
+  name   = "${local.file_md5}.zip"
+  bucket = data.google_storage_bucket.source_bucket.name
+  source = "${path.root}/../build/${var.function_name}.zip"
+}
+
+resource "google_service_account" "service_account" {
+  account_id   = local.short_name
+  display_name = "Price Curves Service Account"
+}
+
+resource "google_cloudfunctions_function" "function" {
+  name                  = local.aligned_name
+  description           = "Cloud Function that serves cached day-ahead price curves."
+  runtime               = "python310"
+  service_account_email = google_service_account.service_account.email
+
+  environment_variables = {
+    PROJECT_ID = terraform.workspace
+  }
+
+  available_memory_mb   = 256
+  source_archive_bucket = data.google_storage_bucket.source_bucket.name
+  source_archive_object = google_storage_bucket_object.archive.name
+  trigger_http          = true
+  entry_point           = var.entry_point
+  timeout               = 60
+}
+
+resource "google_cloudfunctions_function_iam_member" "invoker" {
+  for_each       = toset(var.invoker_members)
+  project        = google_cloudfunctions_function.function.project
+  region         = google_cloudfunctions_function.function.region
+  cloud_function = google_cloudfunctions_function.function.name
+
+  role   = "roles/cloudfunctions.invoker"
+  member = each.value
+}
+
+resource "google_bigquery_dataset_iam_member" "viewer" {
+  dataset_id = "clean"
+  role       = "roles/bigquery.dataViewer"
+  member     = "serviceAccount:${google_service_account.service_account.email}"
+}
+
+resource "google_project_iam_member" "project_bq_job_runner" {
+  project = terraform.workspace
+  role    = "roles/bigquery.jobUser"
+  member  = "serviceAccount:${google_service_account.service_account.email}"
+}
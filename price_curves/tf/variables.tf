@@ -0,0 +1,14 @@
+variable "function_name" {
+  type    = string
+  default = "price_curves"
+}
+
+variable "entry_point" {
+  type = string
+}
+
+variable "invoker_members" {
+  type        = list(string)
+  default     = []
+  description = "Members allowed to call the function, e.g. serviceAccount:billing@project.iam.gserviceaccount.com"
+}
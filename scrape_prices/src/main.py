@@ -1,19 +1,51 @@
+from datetime import date, timedelta
 import logging
 import os
 import sys
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 
 from entsoe import EntsoeRawClient
 from google.cloud import bigquery
+import numpy as np
 import pandas as pd
+from toki_tracing.tracing import span, traced
 import xmltodict
 
+from validation import (
+    DEFAULT_MARKET_TIMEZONE,
+    MARKET_TIMEZONES,
+    REASON_COLUMN,
+    validate_prices,
+)
+
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger()
 
 PROJECT_ID = os.getenv("PROJECT_ID", "toki-data-platform-dev")
 CLEAN_DATASET_ID = "clean"
-PRICES_TABLE_ID = f"{CLEAN_DATASET_ID}.prices"
+PRICES_SCHEMA_VERSION = 2
+PRICES_TABLE_ID = f"{CLEAN_DATASET_ID}.prices_v{PRICES_SCHEMA_VERSION}"
+# Kept up to date until every consumer of the string typed table, e.g. clean.hourly_billing, reads prices_v2
+LEGACY_PRICES_TABLE_ID = f"{CLEAN_DATASET_ID}.prices"
+WRITE_LEGACY_PRICES = os.getenv("WRITE_LEGACY_PRICES", "true").lower() == "true"
+QUARANTINED_PRICES_TABLE_ID = f"{CLEAN_DATASET_ID}.prices_quarantine"
+PRICES_SCHEMA = [
+    bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
+    # market date of the hour in the timezone of the country, see MARKET_TIMEZONES
+    bigquery.SchemaField("date", "DATE", mode="REQUIRED"),
+    bigquery.SchemaField("price", "FLOAT"),
+    bigquery.SchemaField("currency", "STRING"),
+    bigquery.SchemaField("country_code", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("source", "STRING"),
+    bigquery.SchemaField("source_price", "FLOAT"),
+    bigquery.SchemaField("source_currency", "STRING"),
+    # load time of the row, readers pick the latest row when an hour was written more than once
+    bigquery.SchemaField("inserted_at", "TIMESTAMP"),
+]
+PRICES_PARTITION_FIELD = "date"
+PRICES_CLUSTERING_FIELDS = ["country_code"]
+LEGACY_TIMEZONE = "Europe/Sofia"
+MIGRATE_PARAM = "migrate"
 COUNTRY_CODES = ["BG", "HU"]
 ENTSOE_API_KEY = os.getenv("ENTSOE_API_KEY", "")
 EUR_TO_BGN = os.getenv("EUR_TO_BGN", "1.95583")
@@ -23,17 +55,32 @@ ENTSOE_CLIENT = EntsoeRawClient(
     api_key=ENTSOE_API_KEY, retry_count=RETRY_COUNT, retry_delay=RETRY_DELAY
 )
 BIG_QUERY_CLIENT = None
+PRICES_TABLE_READY = False
 WRITE_MODE = "append"
 
 
+@traced(logger)
 def scrape_prices(request) -> str:
     prices_dataframes = []
     request_data = request.get_json()
     start_date, end_date = get_start_end_date(request_data)
+    if request_data and request_data.get(MIGRATE_PARAM):
+        migrate_legacy_prices(start_date, end_date)
+        return "OK"
     for country_code in COUNTRY_CODES:
-        prices_xml = get_prices_data(country_code, start_date, end_date)
+        with span("fetch_prices") as record:
+            record["country_code"] = country_code
+            prices_xml = get_prices_data(country_code, start_date, end_date)
         prices_dataframes.append(format_price_data(prices_xml, country_code))
-    save_to_db(pd.concat(prices_dataframes))
+    prices_df = pd.concat(prices_dataframes)
+    previous_daily_means = load_previous_daily_means(prices_df)
+    with span("validate_prices") as record:
+        prices_df, quarantined_prices_df = validate_prices(prices_df, previous_daily_means)
+        record["quarantined_rows"] = len(quarantined_prices_df)
+    if len(quarantined_prices_df) > 0:
+        save_quarantined_prices(quarantined_prices_df)
+    if len(prices_df) > 0:
+        save_to_db(prices_df)
     return "OK"
 
 
@@ -92,28 +139,44 @@ def format_price_data(prices_xml: str, country_code: str) -> pd.DataFrame:
         pandas.Dataframe:
             price table formatted as a Dataframe
     """
-    dataframes = []
-    parsed_data = xmltodict.parse(prices_xml)
+    with span("parse_xml") as record:
+        record["country_code"] = country_code
+        parsed_data = xmltodict.parse(prices_xml)
     timeseries = parsed_data.get("Publication_MarketDocument").get("TimeSeries")
     timeseries = [timeseries] if not isinstance(timeseries, list) else timeseries
+    with span("build_dataframe") as record:
+        record["country_code"] = country_code
+        record["timeseries"] = len(timeseries)
+        prices_df = build_price_dataframe(timeseries, country_code)
+    return prices_df
+
+
+def build_price_dataframe(timeseries: List[Dict], country_code: str) -> pd.DataFrame:
+    """
+    Build the price table from parsed TimeSeries elements
+      Parameters:
+        timeseries: List[Dict]
+            TimeSeries elements of the parsed XML price document
+        country_code: str
+            country code as defined in https://en.wikipedia.org/wiki/List_of_ISO_3166_country_codes
+      Returns:
+        pandas.Dataframe:
+            price table formatted as a Dataframe
+    """
+    dataframes = []
     for ts in timeseries:
         start = pd.Timestamp(ts.get("Period").get("timeInterval").get("start"))
         end = pd.Timestamp(ts.get("Period").get("timeInterval").get("end"))
-        timestamps = pd.date_range(
-            start=start.tz_convert("Europe/Sofia"),
-            end=end.tz_convert("Europe/Sofia"),
-            freq="h",
-            inclusive="left",
-        )
-        prices = [p.get("price.amount") for p in ts.get("Period").get("Point")]
+        timestamps, prices = get_period_prices(ts, start, end)
         currency = ts.get("currency_Unit.name")
         df = pd.DataFrame()
         df["timestamp"] = timestamps
+        df["date"] = timestamps.tz_convert(
+            MARKET_TIMEZONES.get(country_code, DEFAULT_MARKET_TIMEZONE)
+        ).date
         match (country_code, currency):
             case ("BG", "EUR"):
-                df["price"] = [
-                    str(round(float(price) * float(EUR_TO_BGN), 2)) for price in prices
-                ]
+                df["price"] = (prices * float(EUR_TO_BGN)).round(2)
                 df["currency"] = "BGN"
             case _:
                 df["price"] = prices
@@ -127,16 +190,267 @@ def format_price_data(prices_xml: str, country_code: str) -> pd.DataFrame:
     return pd.concat(dataframes)
 
 
+def get_period_prices(
+    ts: Dict, start: pd.Timestamp, end: pd.Timestamp
+) -> Tuple[pd.DatetimeIndex, np.ndarray]:
+    """
+    Place the points of a TimeSeries on an hourly grid by their position, so that truncated or misaligned series
+    are kept for validation instead of failing the run. Positions without a price are NaN, except for A03 curves
+    where a missing position repeats the previous price. Positions past the end of the interval extend the grid.
+      Parameters:
+        ts: Dict
+            TimeSeries element of the parsed XML price document
+        start: pandas.Timestamp
+            start of the TimeSeries interval
+        end: pandas.Timestamp
+            end of the TimeSeries interval
+      Returns:
+        Tuple[pandas.DatetimeIndex, numpy.ndarray]:
+            UTC timestamps and prices of every hour of the series
+    """
+    points = ts.get("Period").get("Point") or []
+    points = [points] if not isinstance(points, list) else points
+    positions = np.array([int(p.get("position")) for p in points], dtype=np.int64)
+    amounts = pd.to_numeric(
+        [p.get("price.amount") for p in points], errors="coerce"
+    ).astype("float64")
+    interval_hours = int((end - start) / pd.Timedelta(hours=1))
+    hours = max(interval_hours, positions.max(initial=0))
+    prices = np.full(hours, np.nan)
+    is_valid_position = positions >= 1
+    prices[positions[is_valid_position] - 1] = amounts[is_valid_position]
+    if ts.get("curveType") == "A03":
+        prices = pd.Series(prices).ffill().to_numpy()
+    if hours != interval_hours or len(points) != interval_hours:
+        logger.warning(
+            f"TimeSeries from {start} to {end} has {len(points)} points for {interval_hours} hours"
+        )
+    timestamps = pd.date_range(start=start.tz_convert("UTC"), periods=hours, freq="h")
+    return timestamps, prices
+
+
 def save_to_db(prices_df: pd.DataFrame) -> None:
-    schema = get_big_query_client().get_table(f"{PROJECT_ID}.{PRICES_TABLE_ID}").schema
+    ensure_prices_table()
+    insert_schema = [
+        {"name": schema_field.name, "type": schema_field.field_type}
+        for schema_field in PRICES_SCHEMA
+    ]
+    prices_df = prices_df.assign(inserted_at=pd.Timestamp.now(tz="UTC"))
+    with span("to_gbq") as record:
+        record["rows"] = len(prices_df)
+        prices_df.to_gbq(
+            PRICES_TABLE_ID, PROJECT_ID, table_schema=insert_schema, if_exists=WRITE_MODE
+        )
+    logger.info("Inserted data in prices table")
+    if WRITE_LEGACY_PRICES:
+        save_to_legacy_db(prices_df)
+
+
+def save_to_legacy_db(prices_df: pd.DataFrame) -> None:
+    """
+    Append prices to the legacy prices table in its original format: string prices and Europe/Sofia timestamps
+      Parameters:
+        prices_df: pandas.Dataframe
+            price table as returned by format_price_data
+    """
+    with span("get_legacy_table_schema"):
+        schema = get_big_query_client().get_table(f"{PROJECT_ID}.{LEGACY_PRICES_TABLE_ID}").schema
     insert_schema = [
         {"name": schema_field.name, "type": schema_field.field_type}
         for schema_field in schema
     ]
-    prices_df.to_gbq(
-        PRICES_TABLE_ID, PROJECT_ID, table_schema=insert_schema, if_exists=WRITE_MODE
+    legacy_prices_df = prices_df.drop(columns=["date", "inserted_at"], errors="ignore").assign(
+        timestamp=prices_df["timestamp"].dt.tz_convert(LEGACY_TIMEZONE),
+        price=prices_df["price"].map(str),
+        source_price=prices_df["source_price"].map(str),
     )
-    logger.info("Inserted data in prices table")
+    with span("to_gbq_legacy") as record:
+        record["rows"] = len(legacy_prices_df)
+        legacy_prices_df.to_gbq(
+            LEGACY_PRICES_TABLE_ID, PROJECT_ID, table_schema=insert_schema, if_exists=WRITE_MODE
+        )
+    logger.info("Inserted data in legacy prices table")
+
+
+def save_quarantined_prices(prices_df: pd.DataFrame) -> None:
+    insert_schema = [
+        {"name": schema_field.name, "type": schema_field.field_type}
+        for schema_field in PRICES_SCHEMA
+    ] + [{"name": REASON_COLUMN, "type": "STRING"}]
+    prices_df = prices_df.assign(inserted_at=pd.Timestamp.now(tz="UTC"))
+    with span("to_gbq_quarantine") as record:
+        record["rows"] = len(prices_df)
+        prices_df.to_gbq(
+            QUARANTINED_PRICES_TABLE_ID,
+            PROJECT_ID,
+            table_schema=insert_schema,
+            if_exists=WRITE_MODE,
+        )
+    logger.info("Inserted data in prices quarantine table")
+
+
+def load_previous_daily_means(prices_df: pd.DataFrame) -> Dict[Tuple[str, date], float]:
+    """
+    Load the mean source price of the market day before the first day of every country in the run, which is the
+    reference for the day over day check of that first day
+      Parameters:
+        prices_df: pandas.Dataframe
+            price table as returned by format_price_data
+      Returns:
+        Dict[Tuple[str, datetime.date], float]:
+            mean source price of the previous market day by (country_code, date)
+    """
+    previous_dates = {
+        country_code: first_date - timedelta(days=1)
+        for country_code, first_date in prices_df.groupby("country_code")["date"].min().items()
+    }
+    query = f"""
+    SELECT
+        country_code,
+        date,
+        AVG(source_price) AS source_price
+    FROM
+        `{PROJECT_ID}.{PRICES_TABLE_ID}`
+    WHERE
+        country_code IN UNNEST(@country_codes)
+        AND date BETWEEN @start_date AND @end_date
+    GROUP BY
+        country_code,
+        date
+    """  # noqa: S608 Ignoring since parameters are controlled via query params
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("country_codes", "STRING", list(previous_dates)),
+            bigquery.ScalarQueryParameter("start_date", "DATE", min(previous_dates.values())),
+            bigquery.ScalarQueryParameter("end_date", "DATE", max(previous_dates.values())),
+        ]
+    )
+    ensure_prices_table()
+    with span("load_previous_daily_means"):
+        rows = get_big_query_client().query(query, job_config=job_config).result()
+    return {
+        (row["country_code"], row["date"]): row["source_price"]
+        for row in rows
+        if previous_dates.get(row["country_code"]) == row["date"] and row["source_price"] is not None
+    }
+
+
+def ensure_prices_table() -> None:
+    """
+    Create the versioned prices table partitioned by market date and clustered by country code if it does not exist
+    """
+    global PRICES_TABLE_READY
+    if PRICES_TABLE_READY:
+        return
+    table = bigquery.Table(f"{PROJECT_ID}.{PRICES_TABLE_ID}", schema=PRICES_SCHEMA)
+    table.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY, field=PRICES_PARTITION_FIELD
+    )
+    table.clustering_fields = PRICES_CLUSTERING_FIELDS
+    with span("ensure_prices_table"):
+        get_big_query_client().create_table(table, exists_ok=True)
+    PRICES_TABLE_READY = True
+
+
+def migrate_legacy_prices(start_date: pd.Timestamp, end_date: pd.Timestamp) -> None:
+    """
+    Copy rows from the legacy string typed prices table into the versioned prices table in a single transaction.
+    Rows already present in the versioned table for the period are replaced, so the migration can be re-run for the
+    same period, and duplicates left in the legacy table by repeated runs are copied only once.
+    Limitations:
+     - the legacy table has no load time, so when duplicates of an hour have different prices the one with the
+       lowest source price is kept, which is not necessarily the latest correction. The number of such hours is
+       logged, compare them with the source before relying on the migrated period
+     - migrated rows are not checked by validate_prices and no rows are quarantined
+      Parameters:
+        start_date: pandas.Timestamp
+            timestamp marking period start, its date is the first market date to migrate
+        end_date: pandas.Timestamp
+            timestamp marking period end, its date is the last market date to migrate
+    """
+    ensure_prices_table()
+    market_date = get_market_date_expression("timestamp")
+    query = f"""
+    BEGIN TRANSACTION;
+
+    DELETE FROM `{PROJECT_ID}.{PRICES_TABLE_ID}`
+    WHERE date BETWEEN @start_date AND @end_date;
+
+    INSERT INTO `{PROJECT_ID}.{PRICES_TABLE_ID}`
+        (timestamp, date, price, currency, country_code, source, source_price, source_currency)
+    SELECT
+        timestamp,
+        {market_date},
+        CAST(price AS FLOAT64),
+        currency,
+        country_code,
+        source,
+        CAST(source_price AS FLOAT64),
+        source_currency
+    FROM
+        `{PROJECT_ID}.{LEGACY_PRICES_TABLE_ID}`
+    WHERE
+        {market_date} BETWEEN @start_date AND @end_date
+    -- the legacy table has no load time, so duplicates are resolved by a fixed order of their values,
+    -- keeping the lowest price of conflicting duplicates
+    QUALIFY ROW_NUMBER() OVER (
+        PARTITION BY country_code, timestamp ORDER BY source_price, price, currency, source
+    ) = 1;
+
+    COMMIT TRANSACTION;
+    """  # noqa: S608 Ignoring since parameters are controlled via query params
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("start_date", "DATE", start_date.date()),
+            bigquery.ScalarQueryParameter("end_date", "DATE", end_date.date()),
+        ]
+    )
+    with span("migrate_legacy_prices") as record:
+        conflicting_count = count_conflicting_legacy_prices(job_config)
+        record["conflicting_duplicates"] = conflicting_count
+        get_big_query_client().query(query, job_config=job_config).result()
+    if conflicting_count > 0:
+        logger.warning(
+            f"Dropped conflicting duplicates of {conflicting_count} hours from {start_date.date()} to "
+            f"{end_date.date()}, kept their lowest source price"
+        )
+    logger.info(f"Migrated prices from {start_date.date()} to {end_date.date()} into {PRICES_TABLE_ID}")
+
+
+def count_conflicting_legacy_prices(job_config: bigquery.QueryJobConfig) -> int:
+    """
+    Number of (country_code, timestamp) hours of the legacy prices table between the start_date and end_date
+    parameters of job_config that were written more than once with different prices
+    """
+    market_date = get_market_date_expression("timestamp")
+    query = f"""
+    SELECT
+        COUNT(*) AS conflicting_count
+    FROM (
+        SELECT
+            country_code,
+            timestamp
+        FROM
+            `{PROJECT_ID}.{LEGACY_PRICES_TABLE_ID}`
+        WHERE
+            {market_date} BETWEEN @start_date AND @end_date
+        GROUP BY
+            country_code,
+            timestamp
+        HAVING
+            COUNT(DISTINCT FORMAT('%t', (source_price, price, currency, source))) > 1
+    )
+    """  # noqa: S608 Ignoring since parameters are controlled via query params
+    rows = list(get_big_query_client().query(query, job_config=job_config).result())
+    return rows[0]["conflicting_count"] if rows else 0
+
+
+def get_market_date_expression(timestamp_column: str) -> str:
+    cases = " ".join(
+        f"WHEN '{country_code}' THEN DATE({timestamp_column}, '{timezone}')"
+        for country_code, timezone in MARKET_TIMEZONES.items()
+    )
+    return f"CASE country_code {cases} ELSE DATE({timestamp_column}, '{DEFAULT_MARKET_TIMEZONE}') END"
 
 
 def get_big_query_client():
@@ -1,10 +1,17 @@
+from datetime import date
 import unittest
 from unittest.mock import Mock, patch
 
 import flask
 import pandas as pd
 
-from main import format_price_data, get_start_end_date, scrape_prices
+from main import (
+    format_price_data,
+    get_start_end_date,
+    load_previous_daily_means,
+    save_to_db,
+    scrape_prices,
+)
 
 
 class TestScrapePrices(unittest.TestCase):
@@ -72,21 +79,23 @@ class TestScrapePrices(unittest.TestCase):
         self.expected_bg_formatted_prices = pd.DataFrame(
             [
                 {
-                    "timestamp": pd.Timestamp("2022-11-30 02:00:00", tz="Europe/Sofia"),
-                    "price": "547.48",
+                    "timestamp": pd.Timestamp("2022-11-30 00:00:00", tz="UTC"),
+                    "date": date(2022, 11, 30),
+                    "price": 547.48,
                     "currency": "BGN",
                     "country_code": "BG",
                     "source": "Entsoe",
-                    "source_price": "279.92",
+                    "source_price": 279.92,
                     "source_currency": "EUR",
                 },
                 {
-                    "timestamp": pd.Timestamp("2022-11-30 03:00:00", tz="Europe/Sofia"),
-                    "price": "450.25",
+                    "timestamp": pd.Timestamp("2022-11-30 01:00:00", tz="UTC"),
+                    "date": date(2022, 11, 30),
+                    "price": 450.25,
                     "currency": "BGN",
                     "country_code": "BG",
                     "source": "Entsoe",
-                    "source_price": "230.21",
+                    "source_price": 230.21,
                     "source_currency": "EUR",
                 },
             ]
@@ -94,21 +103,23 @@ class TestScrapePrices(unittest.TestCase):
         self.expected_hu_formatted_prices = pd.DataFrame(
             [
                 {
-                    "timestamp": pd.Timestamp("2022-11-30 02:00:00", tz="Europe/Sofia"),
-                    "price": "280.13",
+                    "timestamp": pd.Timestamp("2022-11-30 00:00:00", tz="UTC"),
+                    "date": date(2022, 11, 30),
+                    "price": 280.13,
                     "currency": "EUR",
                     "country_code": "HU",
                     "source": "Entsoe",
-                    "source_price": "280.13",
+                    "source_price": 280.13,
                     "source_currency": "EUR",
                 },
                 {
-                    "timestamp": pd.Timestamp("2022-11-30 03:00:00", tz="Europe/Sofia"),
-                    "price": "224.06",
+                    "timestamp": pd.Timestamp("2022-11-30 01:00:00", tz="UTC"),
+                    "date": date(2022, 11, 30),
+                    "price": 224.06,
                     "currency": "EUR",
                     "country_code": "HU",
                     "source": "Entsoe",
-                    "source_price": "224.06",
+                    "source_price": 224.06,
                     "source_currency": "EUR",
                 },
             ]
@@ -117,7 +128,10 @@ class TestScrapePrices(unittest.TestCase):
             [self.expected_bg_formatted_prices, self.expected_hu_formatted_prices]
         )
 
+    @patch("main.save_quarantined_prices")
     @patch("main.save_to_db")
+    @patch("main.validate_prices")
+    @patch("main.load_previous_daily_means")
     @patch("main.format_price_data")
     @patch("main.get_prices_data")
     @patch("main.get_start_end_date")
@@ -126,9 +140,17 @@ class TestScrapePrices(unittest.TestCase):
         mock_get_start_end_date,
         mock_get_prices_data,
         mock_format_prices_data,
+        mock_load_previous_daily_means,
+        mock_validate_prices,
         mock_save_to_db,
+        mock_save_quarantined_prices,
     ):
         # Given
+        mock_load_previous_daily_means.return_value = {}
+        mock_validate_prices.side_effect = lambda prices_df, previous_daily_means: (
+            prices_df,
+            prices_df.iloc[0:0],
+        )
         mock_get_start_end_date.return_value = (
             self.expected_start_date,
             self.expected_end_date,
@@ -141,8 +163,10 @@ class TestScrapePrices(unittest.TestCase):
             self.expected_bg_formatted_prices,
             self.expected_hu_formatted_prices,
         ]
+        request = Mock(spec=flask.Request)
+        request.get_json.return_value = {}
         # When
-        scrape_prices(Mock(spec=flask.Request))
+        scrape_prices(request)
         actual_get_prices_data_first_call_country_code = (
             mock_get_prices_data.call_args_list[0].args[0]
         )
@@ -178,6 +202,80 @@ class TestScrapePrices(unittest.TestCase):
             self.expected_prices_dataframe, actual_save_to_db_dataframe
         )
         self.assertEqual(1, mock_save_to_db.call_count)
+        self.assertEqual(0, mock_save_quarantined_prices.call_count)
+
+    @patch("main.get_prices_data")
+    @patch("main.get_big_query_client")
+    def test_scrape_prices_with_migrate_parameter_migrates_legacy_prices(
+        self, mock_get_big_query_client, mock_get_prices_data
+    ):
+        # Given
+        request = Mock(spec=flask.Request)
+        request.get_json.return_value = {**self.expected_request_data, "migrate": True}
+        mock_client = mock_get_big_query_client.return_value
+        mock_client.query.return_value.result.side_effect = [iter([{"conflicting_count": 3}]), iter([])]
+
+        # When
+        with self.assertLogs(level="WARNING") as logs:
+            scrape_prices(request)
+        actual_query_parameters = {
+            parameter.name: parameter.value
+            for parameter in mock_client.query.call_args.kwargs["job_config"].query_parameters
+        }
+
+        # Then
+        self.assertEqual(0, mock_get_prices_data.call_count)
+        self.assertEqual(2, mock_client.query.call_count)
+        self.assertIn("HAVING", mock_client.query.call_args_list[0].args[0])
+        self.assertIn("Dropped conflicting duplicates of 3 hours", "\n".join(logs.output))
+        self.assertEqual(
+            {"start_date": date(2022, 12, 1), "end_date": date(2022, 12, 10)},
+            actual_query_parameters,
+        )
+        actual_query = mock_client.query.call_args.args[0]
+        self.assertIn("BEGIN TRANSACTION", actual_query)
+        self.assertIn("QUALIFY ROW_NUMBER()", actual_query)
+        self.assertIn("COMMIT TRANSACTION", actual_query)
+
+    @patch("main.PRICES_TABLE_READY", True)
+    @patch("main.get_big_query_client")
+    @patch("pandas.DataFrame.to_gbq", autospec=True)
+    def test_save_to_db_writes_legacy_prices_table(self, mock_to_gbq, mock_get_big_query_client):
+        # Given
+        mock_get_big_query_client.return_value.get_table.return_value.schema = []
+
+        # When
+        save_to_db(self.expected_bg_formatted_prices)
+        actual_tables = [call.args[1] for call in mock_to_gbq.call_args_list]
+        actual_legacy_prices = mock_to_gbq.call_args_list[1].args[0]
+
+        # Then
+        self.assertEqual(["clean.prices_v2", "clean.prices"], actual_tables)
+        self.assertEqual(["547.48", "450.25"], list(actual_legacy_prices["price"]))
+        self.assertEqual(["279.92", "230.21"], list(actual_legacy_prices["source_price"]))
+        self.assertEqual(
+            [
+                pd.Timestamp("2022-11-30 02:00:00", tz="Europe/Sofia"),
+                pd.Timestamp("2022-11-30 03:00:00", tz="Europe/Sofia"),
+            ],
+            list(actual_legacy_prices["timestamp"]),
+        )
+        self.assertNotIn("date", actual_legacy_prices.columns)
+
+    @patch("main.PRICES_TABLE_READY", True)
+    @patch("main.get_big_query_client")
+    def test_load_previous_daily_means_returns_day_before_first_day(self, mock_get_big_query_client):
+        # Given
+        mock_get_big_query_client.return_value.query.return_value.result.return_value = [
+            {"country_code": "BG", "date": date(2022, 11, 29), "source_price": 250.0},
+            {"country_code": "HU", "date": date(2022, 11, 28), "source_price": 240.0},
+        ]
+
+        # When
+        actual_previous_daily_means = load_previous_daily_means(self.expected_prices_dataframe)
+
+        # Then
+        self.assertEqual({("BG", date(2022, 11, 29)): 250.0}, actual_previous_daily_means)
 
     def test_get_start_end_date_without_request_parameters_returns_current_date(self):
         # When
@@ -207,3 +305,18 @@ class TestScrapePrices(unittest.TestCase):
         pd.testing.assert_frame_equal(
             self.expected_bg_formatted_prices, actual_formatted_prices
         )
+
+    def test_format_price_data_uses_market_timezone_for_date(self):
+        # Given
+        hu_prices_xml = self.expected_hu_api_prices_xml.replace(
+            "2022-11-30T00:00Z", "2022-11-29T22:00Z"
+        ).replace("2022-11-30T02:00Z", "2022-11-30T00:00Z")
+
+        # When
+        actual_formatted_prices = format_price_data(hu_prices_xml, "HU")
+
+        # Then
+        self.assertEqual(
+            [date(2022, 11, 29), date(2022, 11, 30)],
+            list(actual_formatted_prices["date"]),
+        )
@@ -0,0 +1,170 @@
+from datetime import date
+import unittest
+
+import pandas as pd
+
+from main import format_price_data
+from validation import MARKET_TIMEZONES, validate_prices
+
+
+class TestValidatePrices(unittest.TestCase):
+    def make_prices(self, country_code, start, end, source_price=100.0):
+        timestamps = pd.date_range(
+            pd.Timestamp(start, tz="UTC"), pd.Timestamp(end, tz="UTC"), freq="h", inclusive="left"
+        )
+        return pd.DataFrame(
+            {
+                "timestamp": timestamps,
+                "date": timestamps.tz_convert(MARKET_TIMEZONES[country_code]).date,
+                "price": source_price,
+                "currency": "EUR",
+                "country_code": country_code,
+                "source": "Entsoe",
+                "source_price": source_price,
+                "source_currency": "EUR",
+            }
+        )
+
+    def make_prices_xml(self, start, end, prices, curve_type="A01"):
+        points = "".join(
+            f"<Point><position>{position}</position><price.amount>{price}</price.amount></Point>"
+            for position, price in prices.items()
+        )
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+                   <Publication_MarketDocument>
+                     <TimeSeries>
+                       <currency_Unit.name>EUR</currency_Unit.name>
+                       <curveType>{curve_type}</curveType>
+                       <Period>
+                         <timeInterval>
+                           <start>{start}</start>
+                           <end>{end}</end>
+                         </timeInterval>
+                         <resolution>PT60M</resolution>
+                         {points}
+                       </Period>
+                     </TimeSeries>
+                   </Publication_MarketDocument>"""
+
+    def test_validate_prices_accepts_dst_days(self):
+        # Given
+        prices_df = pd.concat(
+            [
+                self.make_prices("BG", "2023-03-25T22:00Z", "2023-03-26T21:00Z"),
+                self.make_prices("HU", "2023-10-28T22:00Z", "2023-10-29T23:00Z"),
+            ]
+        )
+
+        # When
+        actual_prices, actual_quarantined_prices = validate_prices(prices_df)
+
+        # Then
+        self.assertEqual(48, len(actual_prices))
+        self.assertEqual(0, len(actual_quarantined_prices))
+        self.assertEqual(list(prices_df.columns), list(actual_prices.columns))
+
+    def test_validate_prices_quarantines_bad_days(self):
+        # Given
+        prices_df = pd.concat(
+            [
+                self.make_prices("BG", "2022-11-29T22:00Z", "2022-11-30T22:00Z"),
+                self.make_prices("BG", "2022-11-30T22:00Z", "2022-12-01T20:00Z"),
+                self.make_prices("BG", "2022-12-01T22:00Z", "2022-12-02T22:00Z", 5000.0),
+                self.make_prices("HU", "2022-11-29T23:00Z", "2022-11-30T23:00Z"),
+                self.make_prices("HU", "2022-11-30T23:00Z", "2022-12-01T23:00Z"),
+                self.make_prices("HU", "2022-12-01T12:00Z", "2022-12-01T23:00Z"),
+            ]
+        )
+
+        # When
+        actual_prices, actual_quarantined_prices = validate_prices(prices_df)
+        actual_reasons = actual_quarantined_prices.groupby(["country_code", "reason"]).size().to_dict()
+
+        # Then
+        self.assertEqual(48, len(actual_prices))
+        self.assertEqual(
+            {
+                ("BG", "point_count"): 22,
+                ("BG", "price_range"): 24,
+                ("HU", "point_count,timestamps"): 35,
+            },
+            actual_reasons,
+        )
+
+    def test_validate_prices_compares_day_over_day_with_last_valid_adjacent_day(self):
+        # Given
+        prices_df = pd.concat(
+            [
+                self.make_prices("BG", "2022-11-29T22:00Z", "2022-11-30T22:00Z", 100.0),
+                self.make_prices("BG", "2022-11-30T22:00Z", "2022-12-01T22:00Z", 900.0),
+                self.make_prices("BG", "2022-12-01T22:00Z", "2022-12-02T22:00Z", 120.0),
+                self.make_prices("BG", "2022-12-03T22:00Z", "2022-12-04T22:00Z", 950.0),
+            ]
+        )
+
+        # When
+        actual_prices, actual_quarantined_prices = validate_prices(prices_df)
+
+        # Then
+        self.assertEqual({date(2022, 12, 1)}, set(actual_quarantined_prices["date"]))
+        self.assertEqual({"day_over_day"}, set(actual_quarantined_prices["reason"]))
+        self.assertEqual(
+            {date(2022, 11, 30), date(2022, 12, 2), date(2022, 12, 4)}, set(actual_prices["date"])
+        )
+
+    def test_validate_prices_compares_first_day_with_previous_daily_means(self):
+        # Given
+        prices_df = self.make_prices("BG", "2022-11-29T22:00Z", "2022-11-30T22:00Z", 900.0)
+
+        # When
+        actual_prices, actual_quarantined_prices = validate_prices(
+            prices_df, {("BG", date(2022, 11, 29)): 100.0}
+        )
+
+        # Then
+        self.assertEqual(0, len(actual_prices))
+        self.assertEqual({"day_over_day"}, set(actual_quarantined_prices["reason"]))
+
+    def test_validate_prices_quarantines_truncated_series_from_xml(self):
+        # Given
+        prices_df = format_price_data(
+            self.make_prices_xml("2022-11-29T23:00Z", "2022-11-30T23:00Z", {1: 280.13, 2: 224.06}), "HU"
+        )
+
+        # When
+        actual_prices, actual_quarantined_prices = validate_prices(prices_df)
+
+        # Then
+        self.assertEqual(0, len(actual_prices))
+        self.assertEqual(24, len(actual_quarantined_prices))
+        self.assertEqual({"missing_prices"}, set(actual_quarantined_prices["reason"]))
+
+    def test_validate_prices_quarantines_points_past_dst_day_interval_from_xml(self):
+        # Given
+        prices_df = format_price_data(
+            self.make_prices_xml(
+                "2023-03-25T22:00Z", "2023-03-26T21:00Z", {position: 100.0 for position in range(1, 25)}
+            ),
+            "BG",
+        )
+
+        # When
+        actual_prices, actual_quarantined_prices = validate_prices(prices_df)
+
+        # Then
+        self.assertEqual(23, len(actual_prices))
+        self.assertEqual({date(2023, 3, 26)}, set(actual_prices["date"]))
+        self.assertEqual({date(2023, 3, 27)}, set(actual_quarantined_prices["date"]))
+        self.assertEqual({"point_count"}, set(actual_quarantined_prices["reason"]))
+
+    def test_format_price_data_repeats_previous_price_for_a03_curves(self):
+        # When
+        actual_prices = format_price_data(
+            self.make_prices_xml(
+                "2022-11-29T22:00Z", "2022-11-30T22:00Z", {1: 100.0, 5: 120.0}, curve_type="A03"
+            ),
+            "HU",
+        )
+
+        # Then
+        self.assertEqual([100.0] * 4 + [120.0] * 20, list(actual_prices["source_price"]))
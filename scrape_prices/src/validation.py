@@ -0,0 +1,107 @@
+from datetime import date, timedelta
+import logging
+import os
+from typing import Dict, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger()
+
+MARKET_TIMEZONES = {"BG": "Europe/Sofia", "HU": "Europe/Budapest"}
+DEFAULT_MARKET_TIMEZONE = "Europe/Sofia"
+# Harmonised day-ahead clearing price limits of the single day-ahead coupling in EUR/MWh
+MIN_SOURCE_PRICE = float(os.getenv("MIN_SOURCE_PRICE", "-500"))
+MAX_SOURCE_PRICE = float(os.getenv("MAX_SOURCE_PRICE", "4000"))
+MAX_DAY_OVER_DAY_CHANGE = float(os.getenv("MAX_DAY_OVER_DAY_CHANGE", "500"))
+WINDOW_COLUMNS = ["country_code", "date"]
+REASON_COLUMN = "reason"
+
+
+def validate_prices(
+    prices_df: pd.DataFrame, previous_daily_means: Dict[Tuple[str, date], float] = None
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Validate formatted prices per market day and split them into rows that can be written and rows to quarantine.
+    A market day is quarantined as a whole if any of the checks fails for it:
+     - point_count: number of hourly points differs from the 23, 24 or 25 hours of the day in the market timezone
+     - timestamps: timestamps are duplicated or not increasing, e.g. overlapping TimeSeries elements
+     - missing_prices: a point of the series has no price
+     - price_range: a source price is outside MIN_SOURCE_PRICE and MAX_SOURCE_PRICE
+     - day_over_day: the mean source price moved more than MAX_DAY_OVER_DAY_CHANGE from the previous market day,
+       checked only when the previous day is valid, either in this run or in previous_daily_means
+      Parameters:
+        prices_df: pandas.Dataframe
+            price table as returned by format_price_data
+        previous_daily_means: Dict[Tuple[str, datetime.date], float]
+            mean source price of already stored market days by (country_code, date)
+      Returns:
+        Tuple[pandas.Dataframe, pandas.Dataframe]:
+            valid prices and quarantined prices with the failed checks in a reason column
+    """
+    prices_df = prices_df.reset_index(drop=True)
+    window_keys = [prices_df[column] for column in WINDOW_COLUMNS]
+    windows = prices_df.groupby(window_keys, sort=True)
+
+    checks = pd.DataFrame(index=windows.size().index)
+    checks["point_count"] = windows.size() != get_expected_point_counts(checks.index)
+    checks["timestamps"] = has_invalid_timestamps(prices_df).groupby(window_keys).any()
+    checks["missing_prices"] = prices_df["source_price"].isna().groupby(window_keys).any()
+    checks["price_range"] = (
+        (prices_df["source_price"] < MIN_SOURCE_PRICE) | (prices_df["source_price"] > MAX_SOURCE_PRICE)
+    ).groupby(window_keys).any()
+    checks["day_over_day"] = get_day_over_day_outliers(
+        windows["source_price"].mean()[~checks.any(axis=1)], previous_daily_means or {}
+    ).reindex(checks.index, fill_value=False)
+
+    reasons = checks.dot(checks.columns + ",").str.rstrip(",")
+    prices_df[REASON_COLUMN] = reasons.reindex(
+        pd.MultiIndex.from_frame(prices_df[WINDOW_COLUMNS])
+    ).to_numpy()
+    is_quarantined = prices_df[REASON_COLUMN] != ""
+
+    quarantined_windows = reasons[reasons != ""]
+    for (country_code, market_date), reason in quarantined_windows.items():
+        logger.warning(f"Quarantined prices for {country_code} on {market_date}: {reason}")
+    return (
+        prices_df[~is_quarantined].drop(columns=REASON_COLUMN),
+        prices_df[is_quarantined],
+    )
+
+
+def get_day_over_day_outliers(
+    daily_means: pd.Series, previous_daily_means: Dict[Tuple[str, date], float]
+) -> pd.Series:
+    """
+    Flag market days whose mean price moved more than MAX_DAY_OVER_DAY_CHANGE from the previous calendar day.
+    Days are compared in order, so a flagged day is not used as reference and the day after it is not checked.
+    """
+    reference_means = dict(previous_daily_means)
+    is_outlier = pd.Series(False, index=daily_means.index)
+    for (country_code, market_date), mean in daily_means.items():
+        previous_mean = reference_means.get((country_code, market_date - timedelta(days=1)))
+        if previous_mean is not None and abs(mean - previous_mean) > MAX_DAY_OVER_DAY_CHANGE:
+            is_outlier[(country_code, market_date)] = True
+        else:
+            reference_means[(country_code, market_date)] = mean
+    return is_outlier
+
+
+def get_expected_point_counts(windows: pd.MultiIndex) -> pd.Series:
+    """
+    Number of hours in every (country_code, date) window, which is 23 or 25 on DST transition days
+    """
+    expected_counts = pd.Series(0, index=windows)
+    country_codes = windows.get_level_values("country_code")
+    for country_code in country_codes.unique():
+        is_country = country_codes == country_code
+        timezone = MARKET_TIMEZONES.get(country_code, DEFAULT_MARKET_TIMEZONE)
+        days = pd.DatetimeIndex(windows.get_level_values("date")[is_country])
+        day_lengths = (days + pd.Timedelta(days=1)).tz_localize(timezone) - days.tz_localize(timezone)
+        expected_counts[is_country] = day_lengths // pd.Timedelta(hours=1)
+    return expected_counts
+
+
+def has_invalid_timestamps(prices_df: pd.DataFrame) -> pd.Series:
+    is_duplicated = prices_df.duplicated(["country_code", "timestamp"], keep=False)
+    is_not_increasing = prices_df.groupby("country_code")["timestamp"].diff() <= pd.Timedelta(0)
+    return is_duplicated | is_not_increasing